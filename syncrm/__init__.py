@@ -2,6 +2,7 @@
 # vim: set sw=4 sts=4 et tw=120 :
 
 from .api import *
+from .blobstore import *
 from .lines import *
 from .repository import *
 from ._version import __version__
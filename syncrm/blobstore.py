@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# vim: set sw=4 sts=4 et tw=120 :
+
+import hashlib
+import io
+import json
+import logging as log
+import os
+import zipfile
+import zlib
+
+class BlobStore:
+    """
+    Content-addressed storage for the members of the items' blobs.
+
+    Each member of a blob's zip archive is stored once under its SHA-256 digest in .syncrm/objects/.
+    The file .syncrm/objects/index maps the item IDs to the digests of their members.
+    """
+
+    def __init__(self, syncrm_dir):
+        self.objects_dir = syncrm_dir + '/objects'
+        self.index_path = self.objects_dir + '/index'
+
+        os.makedirs(self.objects_dir, exist_ok = True)
+
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as index_file:
+                self.index = json.load(index_file)
+
+
+    def __contains__(self, item_id):
+        return item_id in self.index
+
+
+    def write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as index_file:
+            index_file.write(json.dumps(self.index))
+        os.replace(tmp_path, self.index_path)
+
+
+    def mtime(self, item_id):
+        if not item_id in self.index:
+            return None
+
+        return self.index[item_id]['mtime']
+
+
+    def members(self, item_id):
+        return list(self.index[item_id]['members'].keys())
+
+
+    def object_path(self, digest):
+        return self.objects_dir + '/' + digest[:2] + '/' + digest[2:]
+
+
+    def objects(self):
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = self.objects_dir + '/' + prefix
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+
+            for suffix in os.listdir(prefix_dir):
+                yield prefix + suffix
+
+
+    def add(self, item_id, mtime, blob):
+        """
+        Verify the integrity of a downloaded blob, and store its members.
+
+        Reading each member verifies its CRC. Raises zipfile.BadZipFile if the blob is not a valid zip archive or if any
+        member cannot be decompressed or fails its CRC check.
+        Returns the number of members that were not already present in the store.
+        """
+        try:
+            with zipfile.ZipFile(io.BytesIO(blob)) as blob_zip:
+                contents = {}
+                for info in blob_zip.infolist():
+                    if not info.is_dir():
+                        contents[info.filename] = blob_zip.read(info)
+        except (zlib.error, EOFError, NotImplementedError, ValueError) as e:
+            raise zipfile.BadZipFile('blob for {} is corrupt: {}'.format(item_id, e))
+
+        members = {}
+        new_objects = 0
+        for member, data in contents.items():
+            digest = hashlib.sha256(data).hexdigest()
+            members[member] = digest
+
+            if self._write_object(digest, data):
+                new_objects += 1
+
+        self.index[item_id] = { 'mtime': mtime, 'members': members }
+
+        return new_objects
+
+
+    def read(self, item_id, member):
+        """
+        Read a member of an item from the store, and verify it against its digest.
+        """
+        digest = self.index[item_id]['members'][member]
+        with open(self.object_path(digest), 'rb') as object_file:
+            data = object_file.read()
+
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise IOError('object {} for {} of item {} is corrupt; run syncrm fsck'.format(digest, member, item_id))
+
+        return data
+
+
+    def extract(self, item_id, path):
+        for member in self.members(item_id):
+            member_path = os.path.normpath(os.path.join(path, member))
+            if not member_path.startswith(os.path.normpath(path) + os.sep):
+                raise IOError('refusing to extract {} of item {} outside of {}'.format(member, item_id, path))
+
+            os.makedirs(os.path.dirname(member_path), exist_ok = True)
+            with open(member_path, 'wb') as member_file:
+                member_file.write(self.read(item_id, member))
+
+
+    def forget(self, item_id):
+        del self.index[item_id]
+
+
+    def gc(self, item_ids):
+        """
+        Forget all items not in item_ids, and remove all objects no longer referenced by any item.
+
+        Returns the number of removed objects and the number of reclaimed bytes.
+        """
+        for item_id in list(self.index.keys()):
+            if not item_id in item_ids:
+                log.debug('forgetting item {}'.format(item_id))
+                self.forget(item_id)
+
+        referenced = self._referenced()
+
+        removed = 0
+        reclaimed = 0
+        for digest in list(self.objects()):
+            if digest in referenced:
+                continue
+
+            object_path = self.object_path(digest)
+            log.debug('removing object {}'.format(digest))
+            reclaimed += os.path.getsize(object_path)
+            os.remove(object_path)
+            removed += 1
+
+        return (removed, reclaimed)
+
+
+    def fsck(self):
+        """
+        Verify all objects against their digests, and check that all referenced objects are present.
+
+        Corrupt objects are removed, and items referencing missing or corrupt objects are forgotten, so that the
+        next fetch downloads them again. Returns the list of (item_id, member, digest, problem) tuples.
+        """
+        corrupt = set()
+        for digest in self.objects():
+            with open(self.object_path(digest), 'rb') as object_file:
+                if hashlib.sha256(object_file.read()).hexdigest() != digest:
+                    corrupt.add(digest)
+
+        for digest in corrupt:
+            os.remove(self.object_path(digest))
+
+        problems = []
+        for item_id, entry in list(self.index.items()):
+            for member, digest in entry['members'].items():
+                if digest in corrupt:
+                    problems.append((item_id, member, digest, 'corrupt'))
+                elif not os.path.exists(self.object_path(digest)):
+                    problems.append((item_id, member, digest, 'missing'))
+
+        for item_id in set(problem[0] for problem in problems):
+            self.forget(item_id)
+
+        return problems
+
+
+    def _referenced(self):
+        referenced = set()
+        for entry in self.index.values():
+            referenced.update(entry['members'].values())
+
+        return referenced
+
+
+    def _write_object(self, digest, data):
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            return False
+
+        os.makedirs(os.path.dirname(object_path), exist_ok = True)
+        tmp_path = object_path + '.tmp'
+        with open(tmp_path, 'wb') as object_file:
+            object_file.write(data)
+        os.replace(tmp_path, object_path)
+
+        return True
@@ -32,6 +32,20 @@ def syncrm_cli():
     )
     parser_fetch.set_defaults(cmd = fetch)
 
+    # fsck
+    parser_fsck = subparsers.add_parser('fsck',
+        description = 'Command line program to verify the integrity of the local object store',
+        help = 'verify the integrity of the local object store'
+    )
+    parser_fsck.set_defaults(cmd = fsck)
+
+    # gc
+    parser_gc = subparsers.add_parser('gc',
+        description = 'Command line program to remove unreferenced objects from the local object store',
+        help = 'remove unreferenced objects from the local object store'
+    )
+    parser_gc.set_defaults(cmd = gc)
+
     # init
     parser_init = subparsers.add_parser('init',
         description = 'Command line program to initialize the local repository',
@@ -75,7 +89,7 @@ def syncrm_cli():
     ## end of commands
 
     # add verbosity arg to all commands
-    for p in parser, parser_checkout, parser_fetch, parser_init, parser_status:
+    for p in parser, parser_checkout, parser_fetch, parser_fsck, parser_gc, parser_init, parser_status:
         p.add_argument('-v', '--verbose',
             help = 'increase output verbosity',
             action = 'store_true'
@@ -99,84 +113,119 @@ def checkout(args):
             repo = Repository(repo_dir)
             repo.read_index()
 
-            for item_id, item_full_name in _modified(repo_dir, repo):
-                log.debug('checking out {} -> {}'.format(item_id, item_full_name))
-                with zipfile.ZipFile(repo_dir + '/.syncrm/blobs/' + item_id) as item_zip:
-                    item_files = []
-                    item_haslines = True
-                    item_haspdf = False
-
-                    item_pdf = '{}.pdf'.format(item_id)
-                    if item_pdf in item_zip.namelist():
-                        item_files.append(item_pdf)
-                        item_haspdf = True
-
-                    item_lines = '{}.lines'.format(item_id)
-                    if not item_lines in item_zip.namelist():
-                        item_haslines = False
-
-                    if not item_haslines and not item_haspdf:
-                        log.debug('skipping item {}, since it has neither a .pdf nor a .lines file'.format(item_id))
-                        continue
+            # legacy blobs are only removed once the store index refering to their content has been written
+            legacy_blob_paths = []
+            try:
+                _checkout(repo_dir, repo, legacy_blob_paths)
+            finally:
+                repo.blobs.write_index()
 
-                    # extract
-                    item_tmpdir = '/tmp/syncrm/' + item_id + '/'
-                    if os.path.exists(item_tmpdir):
-                        shutil.rmtree(item_tmpdir)
-
-                    os.makedirs(item_tmpdir)
-                    item_zip.extractall(path=item_tmpdir)
-
-                    if item_haslines:
-                        # create .svg page files from .lines file
-                        log.debug('creating .svg file from .lines file')
-                        item_linesfile = LinesFile(item_tmpdir + item_lines)
-                        item_linespages = item_linesfile.to_svg(item_tmpdir + item_lines)
-
-                        # convert all .svg page files to a single .pdf file
-                        call = [
-                            'rsvg-convert',
-                            '-a',
-                            '-f', 'pdf'
-                        ]
-                        call.extend(item_linespages)
-                        call.extend([
-                            '-o', item_tmpdir + item_lines + '.pdf'
-                        ])
-                        log.debug(str(call))
-                        subprocess.call(call)
-
-                    os.makedirs(os.path.dirname(repo_dir + '/' + item_full_name), exist_ok = True)
-
-                    if item_haspdf and item_haslines:
-                        log.debug('combining original .pdf file and .annotated.pdf file')
-                        subprocess.call([
-                            'pdftk',
-                            item_tmpdir + item_pdf,
-                            'multistamp',
-                            item_tmpdir + item_lines + '.pdf',
-                            'output',
-                            item_tmpdir + item_id + '.annotated.pdf'
-                        ])
-                        shutil.move(
-                            item_tmpdir + '/' + item_id + '.annotated.pdf',
-                            repo_dir + '/' + item_full_name + '.pdf'
-                        )
-                    elif item_haslines: # lines only
-                        shutil.move(
-                            item_tmpdir + '/' + item_id + '.lines.pdf',
-                            repo_dir + '/' + item_full_name + '.pdf'
-                        )
-                    else: # pdf only
-                        shutil.move(
-                            item_tmpdir + '/' + item_id + '.pdf',
-                            repo_dir + '/' + item_full_name + '.pdf'
-                        )
+                for blob_path in legacy_blob_paths:
+                    os.remove(blob_path)
 
     except Exception as e:
         log.error(e, exc_info=args.verbose)
 
 
+def _checkout(repo_dir, repo, legacy_blob_paths):
+    for item_id, item_full_name in _modified(repo_dir, repo):
+        log.debug('checking out {} -> {}'.format(item_id, item_full_name))
+        if not item_id in repo.blobs:
+            # import blobs fetched before the introduction of the object store
+            blob_path = repo_dir + '/.syncrm/blobs/' + item_id
+            if not os.path.exists(blob_path):
+                log.warning('skipping item {}, since it has not been fetched; run syncrm fetch'.format(item_id))
+                continue
+
+            log.debug('importing {}'.format(item_id))
+            with open(blob_path, 'rb') as blob_file:
+                blob = blob_file.read()
+
+            try:
+                repo.blobs.add(item_id, os.path.getmtime(blob_path), blob)
+            except zipfile.BadZipFile as e:
+                log.warning('skipping item {}, since its blob is corrupt; run syncrm fetch: {}'.format(item_id, e))
+                continue
+
+            legacy_blob_paths.append(blob_path)
+
+        item_members = repo.blobs.members(item_id)
+        item_files = []
+        item_haslines = True
+        item_haspdf = False
+
+        item_pdf = '{}.pdf'.format(item_id)
+        if item_pdf in item_members:
+            item_files.append(item_pdf)
+            item_haspdf = True
+
+        item_lines = '{}.lines'.format(item_id)
+        if not item_lines in item_members:
+            item_haslines = False
+
+        if not item_haslines and not item_haspdf:
+            log.debug('skipping item {}, since it has neither a .pdf nor a .lines file'.format(item_id))
+            continue
+
+        # extract
+        item_tmpdir = '/tmp/syncrm/' + item_id + '/'
+        if os.path.exists(item_tmpdir):
+            shutil.rmtree(item_tmpdir)
+
+        os.makedirs(item_tmpdir)
+        try:
+            repo.blobs.extract(item_id, item_tmpdir)
+        except IOError as e:
+            log.warning('skipping item {}, since its content is corrupt; run syncrm fsck: {}'.format(item_id, e))
+            continue
+
+        if item_haslines:
+            # create .svg page files from .lines file
+            log.debug('creating .svg file from .lines file')
+            item_linesfile = LinesFile(item_tmpdir + item_lines)
+            item_linespages = item_linesfile.to_svg(item_tmpdir + item_lines)
+
+            # convert all .svg page files to a single .pdf file
+            call = [
+                'rsvg-convert',
+                '-a',
+                '-f', 'pdf'
+            ]
+            call.extend(item_linespages)
+            call.extend([
+                '-o', item_tmpdir + item_lines + '.pdf'
+            ])
+            log.debug(str(call))
+            subprocess.call(call)
+
+        os.makedirs(os.path.dirname(repo_dir + '/' + item_full_name), exist_ok = True)
+
+        if item_haspdf and item_haslines:
+            log.debug('combining original .pdf file and .annotated.pdf file')
+            subprocess.call([
+                'pdftk',
+                item_tmpdir + item_pdf,
+                'multistamp',
+                item_tmpdir + item_lines + '.pdf',
+                'output',
+                item_tmpdir + item_id + '.annotated.pdf'
+            ])
+            shutil.move(
+                item_tmpdir + '/' + item_id + '.annotated.pdf',
+                repo_dir + '/' + item_full_name + '.pdf'
+            )
+        elif item_haslines: # lines only
+            shutil.move(
+                item_tmpdir + '/' + item_id + '.lines.pdf',
+                repo_dir + '/' + item_full_name + '.pdf'
+            )
+        else: # pdf only
+            shutil.move(
+                item_tmpdir + '/' + item_id + '.pdf',
+                repo_dir + '/' + item_full_name + '.pdf'
+            )
+
+
 def fetch(args):
     try:
         lock_file, repo_dir = _lock_repo_dir()
@@ -186,18 +235,97 @@ def fetch(args):
             api = API(repo.client_token)
             index = api.list_items(with_blob = True)
             repo.write_index(index)
-            for item_id, item in repo:
-                blob_path = repo_dir + '/.syncrm/blobs/' + item_id
-                if os.path.exists(blob_path):
-                    local_mtime = os.path.getmtime(blob_path)
-                    if (local_mtime >= item.mtime):
+            # legacy blobs are only removed once the store index refering to their content has been written
+            legacy_blob_paths = []
+            try:
+                for item_id, item in repo:
+                    stored_mtime = repo.blobs.mtime(item_id)
+                    if stored_mtime is not None and stored_mtime >= item.mtime:
                         print('skipping {} (-> {})'.format(item_id, item.full_name()))
                         continue
 
-                print('fetching {} (-> {})'.format(item_id, item.full_name()))
-                blob = api.download(item_id, item.blob_url)
-                with open(blob_path, 'wb') as blob_file:
-                    blob_file.write(blob)
+                    # import blobs fetched before the introduction of the object store
+                    blob_path = repo_dir + '/.syncrm/blobs/' + item_id
+                    if os.path.exists(blob_path):
+                        legacy_blob_paths.append(blob_path)
+
+                        if os.path.getmtime(blob_path) >= item.mtime:
+                            print('importing {} (-> {})'.format(item_id, item.full_name()))
+                            with open(blob_path, 'rb') as blob_file:
+                                blob = blob_file.read()
+
+                            try:
+                                repo.blobs.add(item_id, item.mtime, blob)
+                                continue
+                            except zipfile.BadZipFile as e:
+                                log.warning('Could not import legacy blob {}, fetching it again: {}'.format(item_id, e))
+
+                    print('fetching {} (-> {})'.format(item_id, item.full_name()))
+                    blob = api.download(item_id, item.blob_url)
+
+                    try:
+                        repo.blobs.add(item_id, item.mtime, blob)
+                    except zipfile.BadZipFile as e:
+                        log.error('Could not store blob {}: {}'.format(item_id, e))
+                        continue
+
+            finally:
+                repo.blobs.write_index()
+
+                for blob_path in legacy_blob_paths:
+                    os.remove(blob_path)
+
+    except Exception as e:
+        log.error(e, exc_info=args.verbose)
+
+
+def fsck(args):
+    try:
+        lock_file, repo_dir = _lock_repo_dir()
+        with lock_file:
+            repo = Repository(repo_dir)
+            problems = repo.blobs.fsck()
+            repo.blobs.write_index()
+
+            for item_id, member, digest, problem in problems:
+                print('{} object {} for {} of item {}'.format(problem, digest, member, item_id))
+
+            if problems:
+                print()
+                print('Affected items have been dropped from the object store; run syncrm fetch to download them.')
+
+    except Exception as e:
+        log.error(e, exc_info=args.verbose)
+
+
+def gc(args):
+    try:
+        lock_file, repo_dir = _lock_repo_dir()
+        with lock_file:
+            repo = Repository(repo_dir)
+            repo.read_index()
+            removed, reclaimed = repo.blobs.gc(set(item_id for item_id, item in repo))
+            repo.blobs.write_index()
+
+            print('removed {} objects, reclaimed {} bytes'.format(removed, reclaimed))
+
+            # remove blobs fetched before the introduction of the object store, once they have been imported
+            blobs_dir = repo_dir + '/.syncrm/blobs'
+            if os.path.exists(blobs_dir):
+                legacy_removed = 0
+                legacy_reclaimed = 0
+                for blob_name in os.listdir(blobs_dir):
+                    if not blob_name in repo.blobs:
+                        continue
+
+                    legacy_reclaimed += os.path.getsize(blobs_dir + '/' + blob_name)
+                    legacy_removed += 1
+                    os.remove(blobs_dir + '/' + blob_name)
+
+                if not os.listdir(blobs_dir):
+                    os.rmdir(blobs_dir)
+
+                print('removed {} imported legacy blobs, reclaimed {} bytes'.format(legacy_removed, legacy_reclaimed))
 
     except Exception as e:
         log.error(e, exc_info=args.verbose)
@@ -223,7 +351,7 @@ def init(args):
     with open(syncrm_dir + '/client_token', 'w') as client_token_file:
         client_token_file.write(api.client_token)
 
-    os.makedirs(syncrm_dir + '/blobs')
+    os.makedirs(syncrm_dir + '/objects')
 
 
 def status(args):
@@ -7,6 +7,8 @@ import logging as log
 
 from dateutil import parser
 
+from .blobstore import BlobStore
+
 class Repository:
     class Item:
         def __init__(self, repo, **kwargs):
@@ -46,6 +48,7 @@ class Repository:
         with open(repo_dir + '/.syncrm/client_token') as client_token_file:
             self.client_token = client_token_file.read()
 
+        self.blobs = BlobStore(repo_dir + '/.syncrm')
         self.items = {}
 
 